@@ -1,24 +1,36 @@
 import sys
 import os
+import json
+import time
 import random
+import socket
+import argparse
+import tracemalloc
+from collections import deque
 import requests
 import musicbrainzngs
 import numpy as np
 
+from concurrent.futures import ProcessPoolExecutor
+
 from mutagen import File as MutagenFile
 
+from player_core import TrackStore, Track, SmartPlaylist, compute_features, parse_lrc
+
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QPushButton, QHBoxLayout, QVBoxLayout,
-    QFileDialog, QLabel, QTableWidget, QTableWidgetItem, QAction, QHeaderView,
+    QFileDialog, QLabel, QTableView, QAction, QHeaderView,
     QSplitter, QLineEdit, QSystemTrayIcon, QMenu, QActionGroup, QTabWidget,
-    QTextEdit, QListWidget, QListWidgetItem, QAbstractItemView, QSlider
+    QTextEdit, QListWidget, QListWidgetItem, QAbstractItemView, QSlider, QInputDialog, QMessageBox
 )
-from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent, QAudioProbe
+from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent, QAudioProbe, QAudioDecoder, QAudioFormat
 from PyQt5.QtGui import (
-    QPixmap, QIcon, QPainter, QColor, QLinearGradient, QRadialGradient, QFont, QDesktopServices
+    QPixmap, QIcon, QPainter, QColor, QLinearGradient, QRadialGradient, QFont, QDesktopServices,
+    QTextCursor, QTextFormat
 )
 from PyQt5.QtCore import (
-    QUrl, Qt, QByteArray, QObject, pyqtSignal, QThread, QPointF, QTimer, QSettings, QPoint
+    QUrl, Qt, QByteArray, QObject, QAbstractTableModel, QModelIndex, QEventLoop, QCoreApplication,
+    QRunnable, QThreadPool, pyqtSignal, QPointF, QTimer, QSettings, QPoint
 )
 
 
@@ -48,6 +60,245 @@ NEON = Theme(
     handle="#00ffd5", groove="rgba(255,255,255,0.22)"
 )
 
+AUDIO_EXTS = (".mp3", ".flac", ".wav", ".m4a")
+UNKNOWN_ARTIST = "Неизвестный исполнитель"
+LIBRARY_INDEX = os.path.join(os.path.expanduser("~"), ".music_player_pro", "library.json")
+
+
+def _extract_art(raw):
+    art = None
+    if hasattr(raw, "tags") and raw.tags:
+        if "APIC:" in raw.tags: art = raw.tags.get("APIC:").data
+        elif "covr" in raw.tags:
+            cv = raw.tags.get("covr")
+            if cv: art = bytes(cv[0])
+    if hasattr(raw, "pictures") and raw.pictures: art = raw.pictures[0].data
+    return art
+
+
+def read_tags(path: str, with_art: bool = True) -> dict:
+    artist = UNKNOWN_ARTIST
+    title = os.path.basename(path)
+    art_bytes = None; dur = 0.0
+    try:
+        easy = MutagenFile(path, easy=True)
+        if easy: artist = easy.get("artist", [artist])[0]; title = easy.get("title", [title])[0]
+        raw = MutagenFile(path)
+        if raw:
+            if getattr(raw, "info", None) and hasattr(raw.info, "length"): dur = float(raw.info.length or 0.0)
+            art_bytes = _extract_art(raw)
+    except Exception: pass
+    t = {"path": path, "artist": artist, "title": title, "dur": dur, "has_art": art_bytes is not None}
+    if with_art: t["art"] = art_bytes
+    return t
+
+
+def read_art(path: str):
+    try:
+        raw = MutagenFile(path)
+        return _extract_art(raw) if raw else None
+    except Exception:
+        return None
+
+
+def _mtime(path: str) -> float:
+    try: return os.path.getmtime(path)
+    except OSError: return -1.0
+
+
+class SidecarCache:
+    ART_NAMES = ("cover", "folder", "front", "album", "albumart")
+    ART_EXTS = (".jpg", ".jpeg", ".png")
+    LYRICS_EXTS = (".lrc", ".txt")
+
+    def __init__(self):
+        self.dirs = {}
+
+    def _listing(self, folder: str) -> dict:
+        m = _mtime(folder); hit = self.dirs.get(folder)
+        if hit and hit[0] == m: return hit[1]
+        try: names = {n.lower(): n for n in os.listdir(folder)}
+        except OSError: names = {}
+        self.dirs[folder] = (m, names)
+        return names
+
+    def _find(self, path: str, stems, exts):
+        folder = os.path.dirname(path); names = self._listing(folder)
+        for stem in stems:
+            for ext in exts:
+                n = names.get(stem + ext)
+                if n: return os.path.join(folder, n)
+        return None
+
+    def _read(self, fp: str, binary: bool):
+        try:
+            if binary:
+                with open(fp, "rb") as f: return f.read()
+            with open(fp, "r", encoding="utf-8-sig", errors="replace") as f: return f.read()
+        except OSError:
+            return None
+
+    def art(self, path: str):
+        stem = os.path.splitext(os.path.basename(path))[0].lower()
+        fp = self._find(path, (stem,) + self.ART_NAMES, self.ART_EXTS)
+        return self._read(fp, True) if fp else None
+
+    def lyrics(self, path: str):
+        stem = os.path.splitext(os.path.basename(path))[0].lower()
+        fp = self._find(path, (stem,), self.LYRICS_EXTS)
+        text = self._read(fp, False) if fp else None
+        return text if text and text.strip() else None
+
+
+def scan_roots(roots) -> list:
+    found = []
+    for folder in roots:
+        if os.path.isfile(folder):
+            if folder.lower().endswith(AUDIO_EXTS): found.append(os.path.abspath(folder))
+            continue
+        for root, _, files in os.walk(folder):
+            for fn in files:
+                if fn.lower().endswith(AUDIO_EXTS):
+                    found.append(os.path.abspath(os.path.join(root, fn)))
+    found.sort()
+    return found
+
+
+def load_library(fp: str = LIBRARY_INDEX) -> dict:
+    try:
+        with open(fp, "r", encoding="utf-8") as f: lib = json.load(f)
+        return lib if isinstance(lib, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_library(lib: dict, fp: str = LIBRARY_INDEX):
+    os.makedirs(os.path.dirname(fp) or ".", exist_ok=True)
+    tmp = fp + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f: json.dump(lib, f, ensure_ascii=False)
+    os.replace(tmp, fp)
+
+
+def library_entry(lib: dict, path: str):
+    e = lib.get(path)
+    if e and e.get("mtime") == _mtime(path): return e
+    return None
+
+
+def resolve_paths(paths, lib: dict, scan: bool = False, job=None):
+    found = scan_roots(paths) if scan else [os.path.abspath(p) for p in paths if os.path.exists(p)]
+    items = []
+    for p in found:
+        if job is not None and job.cancelled: return None
+        items.append((p, library_entry(lib, p)))
+    return items
+
+
+def _index_one(path: str):
+    t = read_tags(path, with_art=False)
+    t["mtime"] = _mtime(path)
+    return t
+
+
+def index_paths(paths, lib: dict, jobs: int = 0, progress=None) -> int:
+    stale = [p for p in paths if library_entry(lib, p) is None]
+    if not stale: return 0
+    workers = max(1, min(jobs or os.cpu_count() or 1, len(stale)))
+    chunk = max(1, len(stale) // (workers * 8))
+    if workers == 1: results = map(_index_one, stale)
+    else: pool = ProcessPoolExecutor(max_workers=workers); results = pool.map(_index_one, stale, chunksize=chunk)
+    try:
+        for n, t in enumerate(results, 1):
+            path = t.pop("path")
+            t["added"] = (lib.get(path) or {}).get("added") or time.time()
+            lib[path] = t
+            if progress: progress(n, len(stale))
+    finally:
+        if workers > 1: pool.shutdown()
+    return len(stale)
+
+
+def write_m3u(fp: str, paths):
+    with open(fp, "w", encoding="utf-8") as f:
+        for p in paths: f.write(p + "\n")
+
+
+FEAT_RATE = 22050
+FEAT_SECONDS = 90
+FEAT_BROKEN, FEAT_TIMEOUT, FEAT_NO_BACKEND, FEAT_CANCELLED = "broken", "timeout", "no-backend", "cancelled"
+
+
+def decode_audio(path: str, seconds: float = FEAT_SECONDS, timeout_ms: int = 60_000, job=None):
+    fmt = QAudioFormat()
+    fmt.setCodec("audio/pcm"); fmt.setSampleRate(FEAT_RATE); fmt.setChannelCount(1)
+    fmt.setSampleSize(16); fmt.setSampleType(QAudioFormat.SignedInt); fmt.setByteOrder(QAudioFormat.LittleEndian)
+    dec = QAudioDecoder(); dec.setAudioFormat(fmt); dec.setSourceFilename(path)
+    chunks = []; state = {"rate": FEAT_RATE, "ch": 1, "n": 0, "why": None}
+    loop = QEventLoop()
+
+    def on_ready():
+        buf = dec.read()
+        if not buf.isValid(): return
+        f = buf.format(); state["rate"] = f.sampleRate() or FEAT_RATE; state["ch"] = max(1, f.channelCount())
+        data = buf.constData(); data.setsize(buf.byteCount())
+        chunks.append(np.frombuffer(data, dtype=np.int16).copy()); state["n"] += len(chunks[-1])
+        if state["n"] >= seconds * state["rate"] * state["ch"]: loop.quit()
+
+    def on_error(code):
+        state["why"] = FEAT_NO_BACKEND if code == QAudioDecoder.ServiceMissingError else FEAT_BROKEN
+        loop.quit()
+
+    def on_timeout():
+        state["why"] = state["why"] or FEAT_TIMEOUT
+        loop.quit()
+
+    def on_poll():
+        if job is not None and job.cancelled:
+            state["why"] = FEAT_CANCELLED; loop.quit()
+
+    dec.bufferReady.connect(on_ready)
+    dec.finished.connect(loop.quit)
+    dec.error.connect(on_error)
+    QTimer.singleShot(timeout_ms, on_timeout)
+    poll = QTimer(); poll.timeout.connect(on_poll); poll.start(100)
+    dec.start(); loop.exec_(); dec.stop(); poll.stop()
+    if state["why"] == FEAT_CANCELLED or not chunks: return state["why"] or FEAT_BROKEN
+    x = np.concatenate(chunks).astype(np.float32) / 32768.0
+    ch = state["ch"]
+    if ch > 1: x = x[:len(x) - len(x) % ch].reshape(-1, ch).mean(axis=1)
+    return x, state["rate"]
+
+
+def extract_features(path: str, job=None):
+    try: dec = decode_audio(path, job=job)
+    except Exception: return None, FEAT_BROKEN
+    if isinstance(dec, str): return None, dec
+    v = compute_features(*dec)
+    return (v, None) if v is not None else (None, FEAT_BROKEN)
+
+
+def _init_feature_process():
+    if QCoreApplication.instance() is None: _init_feature_process.app = QCoreApplication([])
+
+
+def _features_one(path: str):
+    v, why = extract_features(path)
+    return path, None if v is None else [round(float(f), 6) for f in v], why
+
+
+def index_features(paths, lib: dict, jobs: int = 0, progress=None, retry: bool = False) -> int:
+    if retry:
+        for p in paths: (lib.get(p) or {}).pop("feat_failed", None)
+    todo = [p for p in paths if p in lib and lib[p].get("feat") is None and not lib[p].get("feat_failed")]
+    if not todo: return 0
+    workers = max(1, min(jobs or os.cpu_count() or 1, len(todo)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_feature_process) as pool:
+        for n, (path, feat, why) in enumerate(pool.map(_features_one, todo), 1):
+            if feat is not None: lib[path]["feat"] = feat
+            elif why == FEAT_BROKEN: lib[path]["feat_failed"] = True
+            if progress: progress(n, len(todo))
+    return len(todo)
+
 
 def make_tray_icon(accent: str) -> QIcon:
     size = 64
@@ -139,55 +390,88 @@ class Visualizer(QWidget):
             p.drawRoundedRect(x, y, int(bw - 3), bh, 3, 3)
 
 
-class ArtWorker(QObject):
-    art_found = pyqtSignal(QPixmap)
-    finished = pyqtSignal()
+NET_TIMEOUT = 10
 
-    def __init__(self, artist: str, title: str):
-        super().__init__()
-        self.artist = artist
-        self.title = title
 
-    def run(self):
+def fetch_art(artist: str, title: str, job):
+    musicbrainzngs.set_useragent("MusicPlayerPro", "3.0", "https://example.com")
+    res = musicbrainzngs.search_releases(artist=artist, release=title, limit=1)
+    if job.cancelled or not res.get("release-list"): return None
+    rgid = res["release-list"][0]["release-group"]["id"]
+    r = requests.get(f"http://coverartarchive.org/release-group/{rgid}/front-250", timeout=NET_TIMEOUT); r.raise_for_status()
+    return r.content
+
+
+def fetch_lyrics(artist: str, title: str, job) -> str:
+    ua = {"User-Agent": "MusicPlayerPro/3.0"}
+    for url in (f"https://lyrist.vercel.app/api/{artist}/{title}", f"https://api.lyrics.ovh/v1/{artist}/{title}"):
+        if job.cancelled: return None
         try:
-            musicbrainzngs.set_useragent("MusicPlayerPro", "3.0", "https://example.com")
-            res = musicbrainzngs.search_releases(artist=self.artist, release=self.title, limit=1)
-            if not res.get("release-list"):
-                self.finished.emit(); return
-            rgid = res["release-list"][0]["release-group"]["id"]
-            url = f"http://coverartarchive.org/release-group/{rgid}/front-250"
-            r = requests.get(url, timeout=10); r.raise_for_status()
-            pix = QPixmap(); pix.loadFromData(QByteArray(r.content))
-            self.art_found.emit(pix)
-        except Exception:
-            pass
-        finally:
-            self.finished.emit()
-
-
-class LyricsWorker(QObject):
-    text_ready = pyqtSignal(str)
-    finished = pyqtSignal()
-
-    def __init__(self, artist: str, title: str):
+            r = requests.get(url, timeout=8, headers=ua)
+            lyrics = (r.json().get("lyrics") or "").strip() if r.ok else ""
+            if lyrics: return lyrics
+        except Exception: pass
+    return "Текст не найден."
+
+
+class _JobSignals(QObject):
+    done = pyqtSignal(object, object)
+
+
+class FetchJob(QRunnable):
+    def __init__(self, key, fn, signals: _JobSignals):
         super().__init__()
-        self.artist = artist
-        self.title = title
+        self.setAutoDelete(False)
+        self.key = key; self.fn = fn; self.signals = signals
+        self.callbacks = []
+        self.cancelled = False
+        self.started = False
 
     def run(self):
-        ua = {"User-Agent": "MusicPlayerPro/3.0"}
-        lyrics = ""
-        try:
-            r = requests.get(f"https://lyrist.vercel.app/api/{self.artist}/{self.title}", timeout=8, headers=ua)
-            if r.ok: lyrics = (r.json().get("lyrics") or "").strip()
-        except Exception: pass
-        if not lyrics:
-            try:
-                r = requests.get(f"https://api.lyrics.ovh/v1/{self.artist}/{self.title}", timeout=8, headers=ua)
-                if r.ok: lyrics = (r.json().get("lyrics") or "").strip()
-            except Exception: pass
-        if not lyrics: lyrics = "Текст не найден."
-        self.text_ready.emit(lyrics); self.finished.emit()
+        self.started = True
+        result = None
+        if not self.cancelled:
+            try: result = self.fn(self)
+            except Exception: result = None
+        self.signals.done.emit(self, result)
+
+
+class FetchScheduler(QObject):
+    def __init__(self, parent=None, max_threads: int = 4):
+        super().__init__(parent)
+        self.pool = QThreadPool(self); self.pool.setMaxThreadCount(max_threads)
+        self.inflight = {}
+        self.signals = _JobSignals(self); self.signals.done.connect(self._on_done)
+
+    def submit(self, key, fn, callback, priority: int = 0, group: str = None) -> FetchJob:
+        job = self.inflight.get(key)
+        if job and not (job.cancelled and job.started):
+            job.cancelled = False; job.callbacks.append((group, callback))
+            return job
+        job = FetchJob(key, fn, self.signals); job.callbacks.append((group, callback))
+        self.inflight[key] = job
+        self.pool.start(job, priority)
+        return job
+
+    def cancel_group(self, group: str):
+        for job in list(self.inflight.values()):
+            job.callbacks = [(g, cb) for g, cb in job.callbacks if g != group]
+            if not job.callbacks: self._cancel(job)
+
+    def cancel_all(self):
+        for job in list(self.inflight.values()): self._cancel(job)
+
+    def pending(self, group: str) -> int:
+        return sum(1 for j in self.inflight.values() if not j.cancelled and any(g == group for g, _ in j.callbacks))
+
+    def _cancel(self, job: FetchJob):
+        job.cancelled = True; job.callbacks.clear()
+        if self.pool.tryTake(job): self.inflight.pop(job.key, None)
+
+    def _on_done(self, job: FetchJob, result):
+        if self.inflight.get(job.key) is job: del self.inflight[job.key]
+        if job.cancelled: return
+        for _, cb in job.callbacks: cb(result)
 
 
 class SeekSlider(QSlider):
@@ -199,6 +483,66 @@ class SeekSlider(QSlider):
         super().mousePressEvent(e)
 
 
+class TrackTableModel(QAbstractTableModel):
+    HEADERS = ["#", "Артист", "Название", "Время"]
+
+    def __init__(self, main: "SmartPlayer"):
+        super().__init__()
+        self.main = main
+        self.current_id = -1
+        self.rows = None  # sorted playlist rows shown by the filter, None = all
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid(): return 0
+        return len(self.main.playlist) if self.rows is None else len(self.rows)
+
+    def source_row(self, r: int) -> int:
+        return r if self.rows is None else int(self.rows[r])
+
+    def view_row(self, r: int) -> int:
+        if self.rows is None or r < 0: return r
+        i = int(np.searchsorted(self.rows, r))
+        return i if i < len(self.rows) and self.rows[i] == r else -1
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 4
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal: return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid(): return None
+        r, c = self.source_row(index.row()), index.column()
+        if role == Qt.DisplayRole:
+            t = self.main.playlist[r]
+            if c == 0: return str(r + 1)
+            if c == 1: return t.artist
+            if c == 2: return t.title
+            return self.main._fmt_dur(self.main.playlist.dur(r))
+        if role == Qt.BackgroundRole and c == 0 and self.main.playlist[r].id == self.current_id:
+            return QColor(self.main.theme.handle)
+        return None
+
+    def set_current(self, tid: int):
+        rows = [self.view_row(self.main.playlist.row_of(x)) for x in (self.current_id, tid)]
+        self.current_id = tid
+        for r in rows:
+            if r >= 0: self.dataChanged.emit(self.index(r, 0), self.index(r, 0))
+
+    def row_changed(self, r: int):
+        r = self.view_row(r)
+        if r >= 0: self.dataChanged.emit(self.index(r, 0), self.index(r, 3))
+
+    def append_rows(self, first: int, last: int):
+        # while filtered, new rows show up on the next set_rows()
+        if self.rows is None and first <= last:
+            self.beginInsertRows(QModelIndex(), first, last); self.endInsertRows()
+
+    def set_rows(self, rows):
+        self.beginResetModel(); self.rows = rows; self.endResetModel()
+
+
 class MiniPlayer(QWidget):
     def __init__(self, main: "SmartPlayer"):
         super().__init__()
@@ -217,10 +561,10 @@ class MiniPlayer(QWidget):
         self.play_btn.clicked.connect(self.main.toggle_play_pause)
         self.next_btn.clicked.connect(self.main._next_track)
 
-    def update_track(self, t: dict):
-        self.title.setText(f"{t['artist']} — {t['title']}")
-        if t.get("art"):
-            pix = QPixmap(); pix.loadFromData(QByteArray(t["art"]))
+    def update_track(self, t: Track, art=None):
+        self.title.setText(f"{t.artist} — {t.title}")
+        if art:
+            pix = QPixmap(); pix.loadFromData(QByteArray(art))
             self.art.setPixmap(pix.scaled(80, 80, Qt.KeepAspectRatio, Qt.SmoothTransformation))
 
 
@@ -234,24 +578,34 @@ class SmartPlayer(QMainWindow):
 
         self.bg = DynamicBackground(self.theme); self.setCentralWidget(self.bg)
         self.player = QMediaPlayer(self); self.probe = None
+        self.player.setNotifyInterval(250)
 
-        self.playlist = []
-        self.index = -1
+        self.playlist = TrackStore(); self.columns = self.playlist.columns
+        self.index = -1; self.current_id = -1; self.current_art = None
         self.repeat_mode = 0
         self.shuffle = False
         self.shuffle_history = []
 
-        self.queue = []  # list of file paths
+        self.queue = []  # list of track ids
         self.fade_ms = 600
         self.fade_timer = None
         self.fade_step = 0
         self.fade_target = 0
         self.fade_base_volume = 80
 
-        self.art_thread = None; self.art_worker = None
-        self.lyr_thread = None; self.lyr_worker = None
+        self.fetch = FetchScheduler(self); self.sidecar = SidecarCache()
+        self.lyr_sync = None; self.lyr_line = -1
+        self.tags_pending = set()
+        self.meta_timer = QTimer(self); self.meta_timer.setSingleShot(True); self.meta_timer.setInterval(200)
+        self.meta_timer.timeout.connect(self._library_changed)
+        QApplication.instance().aboutToQuit.connect(self._shutdown)
+        self.feat_pending = deque(); self.feat_skip = set()
+        self.autoplay = False; self.autoplay_recent = deque(maxlen=50)
         self.mini = None
         self.settings = QSettings("MusicPlayerPro", "SmartPlayer")
+        self.library = load_library(); self.library_dirty = False
+        self.save_timer = QTimer(self); self.save_timer.timeout.connect(self._save_library); self.save_timer.start(300_000)
+        self.smart_playlists = []; self.smart_active = None
 
         self._build_ui()
         self._build_menus()
@@ -277,13 +631,14 @@ class SmartPlayer(QMainWindow):
         self.tabs.addTab(self.tab_lyrics, "Текст")
         self.tabs.addTab(self.tab_queue, "Очередь")
 
-        self.table = QTableWidget(0, 4)
-        self.table.setHorizontalHeaderLabels(["#", "Артист", "Название", "Время"])
+        self.model = TrackTableModel(self)
+        self.table = QTableView(); self.table.setModel(self.model)
+        self.table.verticalHeader().hide()
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-        self.table.setSelectionBehavior(QTableWidget.SelectRows)
-        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
         self.table.setAlternatingRowColors(True)
-        self.table.doubleClicked.connect(lambda i: self.play_index(i.row()))
+        self.table.doubleClicked.connect(lambda i: self.play_index(self.model.source_row(i.row())))
         self.table.setContextMenuPolicy(Qt.CustomContextMenu)
         self.table.customContextMenuRequested.connect(self._table_menu)
 
@@ -393,9 +748,14 @@ class SmartPlayer(QMainWindow):
             theme_menu.addAction(act); group.addAction(act)
             if th is self.theme: act.setChecked(True)
 
+        self.smart_menu = self.menuBar().addMenu("Смарт-плейлисты"); self.smart_group = None
+
         view_menu = self.menuBar().addMenu("Вид")
         a_mini = QAction("Открыть мини-плеер", self); a_mini.setShortcut("Ctrl+M"); a_mini.triggered.connect(self._show_mini)
         view_menu.addAction(a_mini)
+        self.a_autoplay = QAction("Автоплей похожих треков", self, checkable=True)
+        self.a_autoplay.triggered.connect(self._toggle_autoplay)
+        view_menu.addAction(self.a_autoplay)
 
     def _create_tray(self):
         self.tray = QSystemTrayIcon(self.tray_icon, self)
@@ -420,6 +780,7 @@ class SmartPlayer(QMainWindow):
         self.theme = t
         self.bg.set_theme(t); self.visualizer.set_theme(t)
         icon = make_tray_icon(self.theme.accent); self.tray.setIcon(icon); self.setWindowIcon(icon)
+        self.model.set_current(self.model.current_id); self.lyr_line = -1
         self._apply_theme()
 
     def _apply_theme(self):
@@ -434,7 +795,7 @@ class SmartPlayer(QMainWindow):
             QTabWidget::pane {{ border: 1px solid {th.groove}; border-radius: 12px; background: {th.panel}; }}
             QTabBar::tab {{ padding: 6px 12px; background: {th.panel}; border-radius: 10px; margin: 2px; }}
             QTabBar::tab:selected {{ background: {th.handle}; color: black; }}
-            QTableWidget {{ background: {th.row}; alternate-background-color: {th.alt}; border-radius: 10px; }}
+            QTableView {{ background: {th.row}; alternate-background-color: {th.alt}; border-radius: 10px; }}
             QHeaderView::section {{ background: {th.panel}; border: none; padding: 8px; }}
             QSlider::groove:horizontal {{ height: 8px; background: {th.groove}; border-radius: 4px; }}
             QSlider::handle:horizontal {{ background: {th.handle}; border: 1px solid {th.handle}; width: 18px; margin:-5px 0; border-radius: 9px; }}
@@ -468,44 +829,33 @@ class SmartPlayer(QMainWindow):
 
     def _add_files(self):
         files, _ = QFileDialog.getOpenFileNames(self, "Выбрать аудио", "", "Аудиофайлы (*.mp3 *.flac *.wav *.m4a)")
-        if not files: return
-        for f in files: self._add_track(f)
-        if self.index == -1 and self.playlist: self.play_index(0)
+        if files: self._add_paths(files)
 
     def _add_folder(self):
         folder = QFileDialog.getExistingDirectory(self, "Выбрать папку с музыкой")
-        if not folder: return
-        for root, _, files in os.walk(folder):
-            for fn in files:
-                if fn.lower().endswith((".mp3", ".flac", ".wav", ".m4a")):
-                    self._add_track(os.path.join(root, fn))
-        if self.index == -1 and self.playlist: self.play_index(0)
+        if folder: self._add_paths([folder], scan=True)
 
     def _save_playlist(self):
         if not self.playlist: return
         fp, _ = QFileDialog.getSaveFileName(self, "Сохранить плейлист", "", "M3U Playlist (*.m3u)")
         if not fp: return
-        with open(fp, "w", encoding="utf-8") as f:
-            for t in self.playlist: f.write(t["path"] + "\n")
+        write_m3u(fp, [t.path for t in self.playlist])
         self.settings.setValue("last_playlist", fp)
 
     def _load_playlist(self):
         fp, _ = QFileDialog.getOpenFileName(self, "Загрузить плейлист", "", "M3U Playlist (*.m3u)")
         if not fp: return
         self._clear_playlist()
-        with open(fp, "r", encoding="utf-8") as f:
-            for line in f:
-                p = line.strip()
-                if p and os.path.exists(p): self._add_track(p)
-        if self.index == -1 and self.playlist: self.play_index(0)
+        with open(fp, "r", encoding="utf-8") as f: self._add_paths([p for p in map(str.strip, f) if p])
         self.settings.setValue("last_playlist", fp)
 
     def _clear_playlist(self):
-        self._stop_art_thread()
+        self.fetch.cancel_all(); self.feat_pending.clear(); self.tags_pending.clear()
         if self.probe: self.probe.setSource(None)
         self.player.setMedia(QMediaContent())
-        self.playlist.clear(); self.table.setRowCount(0)
-        self.index = -1; self.shuffle_history.clear()
+        self.playlist.clear(); self.model.current_id = -1; self.model.set_rows(None)
+        for sp in self.smart_playlists: sp.ids.clear()
+        self.index = -1; self.current_id = -1; self.current_art = None; self.shuffle_history.clear()
         self.queue.clear(); self.queue_list.clear()
         self.visualizer.update_magnitudes(np.zeros(self.visualizer.num_bars))
         self.album_art.setText("No Art"); self.album_art.setPixmap(QPixmap())
@@ -515,61 +865,91 @@ class SmartPlayer(QMainWindow):
         if not seconds or seconds <= 0: return "--:--"
         s = int(round(seconds)); m, s = divmod(s, 60); return f"{m:02d}:{s:02d}"
 
-    def _add_track(self, path: str):
-        artist = "Неизвестный исполнитель"
-        title = os.path.basename(path)
-        art_bytes = None; dur = 0.0
-        try:
-            easy = MutagenFile(path, easy=True)
-            if easy: artist = easy.get("artist", [artist])[0]; title = easy.get("title", [title])[0]
-            raw = MutagenFile(path)
-            if raw:
-                if getattr(raw, "info", None) and hasattr(raw.info, "length"): dur = float(raw.info.length or 0.0)
-                if hasattr(raw, "tags") and raw.tags:
-                    if "APIC:" in raw.tags: art_bytes = raw.tags.get("APIC:").data
-                    elif "covr" in raw.tags:
-                        cv = raw.tags.get("covr"); 
-                        if cv: art_bytes = cv[0]
-                if hasattr(raw, "pictures") and raw.pictures: art_bytes = raw.pictures[0].data
-        except Exception: pass
-        self.playlist.append({"path": path, "artist": artist, "title": title, "art": art_bytes, "dur": dur})
-        r = self.table.rowCount(); self.table.insertRow(r)
-        self.table.setItem(r, 0, QTableWidgetItem(str(r + 1)))
-        self.table.setItem(r, 1, QTableWidgetItem(artist))
-        self.table.setItem(r, 2, QTableWidgetItem(title))
-        self.table.setItem(r, 3, QTableWidgetItem(self._fmt_dur(dur)))
+    def _add_paths(self, paths, scan: bool = False, fade: bool = True):
+        # the folder walk and the per-file stat behind the index lookup run on the pool
+        self.fetch.submit(("paths", time.monotonic()), lambda job, lib=self.library: resolve_paths(paths, lib, scan, job),
+                          lambda items: self._on_paths(items, fade), priority=4, group="paths")
+
+    def _on_paths(self, items, fade: bool):
+        if not items: return
+        first = len(self.playlist)
+        for path, e in items: self._add_track(path, e)
+        self.model.append_rows(first, len(self.playlist) - 1)
+        self._library_changed()
+        if self.index == -1 and self.playlist: self.play_index(0, fade=fade)
+
+    def _add_track(self, path: str, e=None):
+        if e:
+            self.playlist.add(path, e["artist"], e["title"], e["dur"], e.get("added") or time.time(), e["has_art"], e.get("feat"))
+        else:
+            t = self.playlist.add(path, UNKNOWN_ARTIST, os.path.basename(path), 0.0, time.time(), False)
+            self.tags_pending.add(t.id)
+            self.fetch.submit(("tags", path), lambda job, p=path: read_tags(p, with_art=False),
+                              lambda tags, tid=t.id: self._on_tags(tid, tags), priority=0, group="tags")
+
+    def _on_tags(self, tid: int, tags):
+        self.tags_pending.discard(tid)
+        if not tags: return
+        path = tags["path"]
+        added = (self.library.get(path) or {}).get("added") or time.time()
+        self.library[path] = {"artist": tags["artist"], "title": tags["title"], "dur": tags["dur"], "has_art": tags["has_art"],
+                              "mtime": _mtime(path), "added": added}
+        self.library_dirty = True
+        r = self.playlist.update(tid, tags["artist"], tags["title"], tags["dur"], tags["has_art"])
+        if r < 0: return
+        self.model.row_changed(r)
+        for sp in self.smart_playlists: sp.recheck(self.columns, r)
+        if tid == self.current_id: self._show_track_info(self.playlist[r])
+        self.meta_timer.start()
 
     def play_index(self, i: int, *, fade=True):
         if not (0 <= i < len(self.playlist)): return
-        self._ensure_probe(); self._stop_art_thread()
+        self._ensure_probe()
         if fade: self._fade_out_then(lambda: self._start_track(i))
         else: self._start_track(i)
 
     def _start_track(self, i: int):
-        self.index = i; self.table.selectRow(i)
-        for r in range(self.table.rowCount()):
-            self.table.item(r, 0).setBackground(QColor(0, 0, 0, 0))
-        self.table.item(i, 0).setBackground(QColor(self.theme.handle))
         t = self.playlist[i]
-        self.player.setMedia(QMediaContent(QUrl.fromLocalFile(t["path"])))
+        self.index = i; self.current_id = t.id
+        v = self.model.view_row(i)
+        if v >= 0: self.table.selectRow(v)
+        self.autoplay_recent.append(t.id)
+        self.model.set_current(t.id)
+        self.player.setMedia(QMediaContent(QUrl.fromLocalFile(t.path)))
         self.player.play(); self.btn_play.setText("⏸")
-        self.now_playing.setText(f"{t['artist']} — {t['title']}")
-        self.tray.showMessage("Сейчас играет", f"{t['artist']} — {t['title']}", self.windowIcon(), 1800)
-        if t.get("art"):
-            pix = QPixmap(); pix.loadFromData(QByteArray(t["art"]))
-            self.album_art.setPixmap(pix.scaled(280, 280, Qt.KeepAspectRatio, Qt.SmoothTransformation))
-        else:
-            self.album_art.setText("Ищем обложку…")
-            self.art_thread = QThread(); self.art_worker = ArtWorker(t["artist"], t["title"])
-            self.art_worker.moveToThread(self.art_thread)
-            self.art_thread.started.connect(self.art_worker.run)
-            self.art_worker.art_found.connect(lambda p: self.album_art.setPixmap(p.scaled(280, 280, Qt.KeepAspectRatio, Qt.SmoothTransformation)))
-            self.art_worker.finished.connect(self.art_thread.quit)
-            self.art_thread.start()
-        if self.mini: self.mini.update_track(t)
-        self._fetch_lyrics(t["artist"], t["title"])
+        self._show_track_info(t)
         self._fade_in_to(self.volume.value())
 
+    def _show_track_info(self, t: Track):
+        self.fetch.cancel_group("art"); self.current_art = None
+        self.now_playing.setText(f"{t.artist} — {t.title}")
+        self.album_art.setText("Ищем обложку…")
+        if self.mini: self.mini.update_track(t)
+        if t.id in self.tags_pending:
+            self.fetch.cancel_group("lyrics"); self._set_lyrics("Ищем текст…"); return
+        self.tray.showMessage("Сейчас играет", f"{t.artist} — {t.title}", self.windowIcon(), 1800)
+        self.fetch.submit(("local-art", t.path), lambda job, p=t.path, h=t.has_art: (read_art(p) if h else None) or self.sidecar.art(p),
+                          lambda data, tid=t.id: self._on_local_art(tid, data), priority=3, group="art")
+        self._fetch_lyrics(t.artist, t.title, t.path)
+
+    def _on_local_art(self, tid: int, data):
+        if tid != self.current_id: return
+        if data:
+            self._on_art(tid, data); return
+        t = self.playlist.get(tid)
+        if not t: return
+        self.fetch.submit(("art", t.artist, t.title), lambda job, a=t.artist, n=t.title: fetch_art(a, n, job),
+                          lambda data, tid=tid: self._on_art(tid, data), priority=2, group="art")
+
+    def _on_art(self, tid: int, data):
+        if tid != self.current_id: return
+        if not data:
+            self.album_art.setText("No Art"); return
+        self.current_art = data
+        pix = QPixmap(); pix.loadFromData(QByteArray(data))
+        self.album_art.setPixmap(pix.scaled(280, 280, Qt.KeepAspectRatio, Qt.SmoothTransformation))
+        if self.mini: self.mini.update_track(self.playlist.get(tid), data)
+
     def toggle_play_pause(self):
         if self.player.state() == QMediaPlayer.PlayingState:
             self.player.pause(); self.btn_play.setText("▶")
@@ -589,14 +969,19 @@ class SmartPlayer(QMainWindow):
 
     def _next_source(self) -> int:
         if self.queue:
-            path = self.queue.pop(0)
+            tid = self.queue.pop(0)
             self._queue_refresh()
-            for idx, t in enumerate(self.playlist):
-                if t["path"] == path: return idx
+            idx = self.playlist.row_of(tid)
+            if idx >= 0: return idx
+        if self.autoplay and self.repeat_mode == 0 and (self.shuffle or self.index + 1 >= len(self.playlist)):
+            idx = self._similar_source()
+            if idx >= 0:
+                if self.shuffle: self.shuffle_history.append(self.current_id)
+                return idx
         if self.shuffle:
             if len(self.playlist) <= 1: return self.index
             choices = [idx for idx in range(len(self.playlist)) if idx != self.index]
-            pick = random.choice(choices); self.shuffle_history.append(self.index)
+            pick = random.choice(choices); self.shuffle_history.append(self.current_id)
             return pick
         nxt = (self.index + 1)
         if nxt >= len(self.playlist):
@@ -604,9 +989,48 @@ class SmartPlayer(QMainWindow):
             return -1
         return nxt
 
+    def _similar_source(self) -> int:
+        recent = [r for r in map(self.playlist.row_of, self.autoplay_recent) if r >= 0]
+        best = self.columns.nearest(self.index, recent)
+        return int(random.choice(best[:3])) if len(best) else -1
+
+    def _toggle_autoplay(self):
+        self.autoplay = self.a_autoplay.isChecked()
+        if self.autoplay: self._start_feature_job()
+        else: self.fetch.cancel_group("feat"); self.feat_pending.clear()
+
+    def _start_feature_job(self):
+        if not self.autoplay: return
+        has = self.columns.has_feat
+        self.feat_pending = deque((t.id, t.path) for r, t in enumerate(self.playlist)
+                                  if not has[r] and t.path not in self.feat_skip
+                                  and not self.library.get(t.path, {}).get("feat_failed"))
+        self._pump_features()
+
+    def _pump_features(self):
+        limit = max(1, self.fetch.pool.maxThreadCount() - 2)
+        while self.feat_pending and self.fetch.pending("feat") < limit:
+            tid, path = self.feat_pending.popleft()
+            self.fetch.submit(("feat", path), lambda job, p=path: extract_features(p, job),
+                              lambda res, tid=tid, p=path: self._on_feature(tid, p, *(res or (None, FEAT_TIMEOUT))),
+                              priority=-1, group="feat")
+
+    def _on_feature(self, tid: int, path: str, feat, why=None):
+        e = self.library.get(path)
+        if feat is None:
+            self.feat_skip.add(path)
+            if why == FEAT_NO_BACKEND: self.feat_pending.clear()
+            if why == FEAT_BROKEN and e is not None: e["feat_failed"] = True; self.library_dirty = True
+        elif e is not None:
+            e["feat"] = [round(float(f), 6) for f in feat]; self.library_dirty = True
+        r = self.playlist.row_of(tid)
+        if r >= 0 and feat is not None: self.columns.set_feat(r, feat)
+        self._pump_features()
+
     def _prev_source(self) -> int:
-        if self.shuffle and self.shuffle_history:
-            return self.shuffle_history.pop()
+        while self.shuffle and self.shuffle_history:
+            idx = self.playlist.row_of(self.shuffle_history.pop())
+            if idx >= 0: return idx
         prv = (self.index - 1)
         if prv < 0:
             if self.repeat_mode == 1: return len(self.playlist) - 1
@@ -626,32 +1050,118 @@ class SmartPlayer(QMainWindow):
             if idx >= 0: self.play_index(idx)
     def _on_position(self, pos: int):
         self.slider.setValue(pos); self.current_time.setText(self._fmt_time(pos))
+        self._sync_lyrics(pos)
     def _on_duration(self, dur: int):
         self.slider.setRange(0, dur); self.total_time.setText(self._fmt_time(dur))
     @staticmethod
     def _fmt_time(ms: int) -> str:
         s = int(round(ms / 1000)); m, s = divmod(s, 60); return f"{m:02d}:{s:02d}"
 
-    def _fetch_lyrics(self, artist: str, title: str):
-        if self.lyr_thread and self.lyr_thread.isRunning(): return
-        self.lyrics.setPlainText("Ищем текст…")
-        self.lyr_thread = QThread(); self.lyr_worker = LyricsWorker(artist, title)
-        self.lyr_worker.moveToThread(self.lyr_thread)
-        self.lyr_thread.started.connect(self.lyr_worker.run)
-        self.lyr_worker.text_ready.connect(self.lyrics.setPlainText)
-        self.lyr_worker.finished.connect(self.lyr_thread.quit)
-        self.lyr_thread.start()
+    def _fetch_lyrics(self, artist: str, title: str, path: str = None):
+        self.fetch.cancel_group("lyrics")
+        self._set_lyrics("Ищем текст…")
+        if path:
+            self.fetch.submit(("local-lyrics", path), lambda job, p=path: self.sidecar.lyrics(p),
+                              lambda text, tid=self.current_id: self._on_local_lyrics(tid, artist, title, text),
+                              priority=3, group="lyrics")
+        else:
+            self._fetch_net_lyrics(artist, title)
+
+    def _on_local_lyrics(self, tid: int, artist: str, title: str, text):
+        if tid != self.current_id: return
+        if text: self._set_lyrics(text)
+        else: self._fetch_net_lyrics(artist, title)
+
+    def _fetch_net_lyrics(self, artist: str, title: str):
+        self.fetch.submit(("lyrics", artist, title), lambda job: fetch_lyrics(artist, title, job),
+                          lambda text, tid=self.current_id: self._on_lyrics(tid, text), priority=1, group="lyrics")
+
+    def _on_lyrics(self, tid: int, text):
+        if tid == self.current_id: self._set_lyrics(text or "Текст не найден.")
+
+    def _set_lyrics(self, text: str):
+        self.lyr_sync = parse_lrc(text); self.lyr_line = -1
+        self.lyrics.setExtraSelections([])
+        if self.lyr_sync:
+            self.lyrics.setPlainText("\n".join(self.lyr_sync[1]))
+            self._sync_lyrics(self.player.position())
+        else:
+            self.lyrics.setPlainText(text.strip())
+
+    def _sync_lyrics(self, pos: int):
+        if not self.lyr_sync: return
+        i = int(np.searchsorted(self.lyr_sync[0], pos, side="right")) - 1
+        if i == self.lyr_line: return
+        self.lyr_line = i
+        if i < 0:
+            self.lyrics.setExtraSelections([]); return
+        cur = QTextCursor(self.lyrics.document().findBlockByNumber(i))
+        sel = QTextEdit.ExtraSelection(); sel.cursor = cur
+        sel.format.setBackground(QColor(self.theme.handle)); sel.format.setForeground(QColor("black"))
+        sel.format.setProperty(QTextFormat.FullWidthSelection, True)
+        self.lyrics.setExtraSelections([sel])
+        self.lyrics.setTextCursor(cur); self.lyrics.ensureCursorVisible()
 
     def _filter(self):
-        st = self.search.text().lower()
-        for r in range(self.table.rowCount()):
-            a = self.table.item(r, 1).text().lower()
-            t = self.table.item(r, 2).text().lower()
-            self.table.setRowHidden(r, st not in a and st not in t)
-
-    def _stop_art_thread(self):
-        if self.art_thread and self.art_thread.isRunning():
-            self.art_thread.quit(); self.art_thread.wait()
+        text = self.search.text().strip()
+        mask = self.columns.search(text) if text else None
+        if self.smart_active:
+            self.smart_active.sync(self.columns)
+            hit = self.smart_active.mask(self.columns)
+            mask = hit if mask is None else mask & hit
+        rows = None if mask is None else np.flatnonzero(mask)
+        old = self.model.rows
+        if (rows is None and old is None) or (rows is not None and old is not None and np.array_equal(rows, old)): return
+        self.model.set_rows(rows)
+
+    def _library_changed(self):
+        self._filter()
+        self._start_feature_job()
+
+    def _smart_rebuild_menu(self):
+        m = self.smart_menu; m.clear()
+        if self.smart_group: self.smart_group.deleteLater()
+        self.smart_group = QActionGroup(m); self.smart_group.setExclusive(True)
+        a_new = QAction("Новый смарт-плейлист…", m); a_new.triggered.connect(self._smart_new)
+        a_all = QAction("Все треки", m, checkable=True); a_all.triggered.connect(lambda: self._smart_activate(None))
+        a_del = QAction("Удалить текущий", m); a_del.triggered.connect(self._smart_delete)
+        a_del.setEnabled(self.smart_active is not None)
+        self.smart_menu.addAction(a_new); self.smart_menu.addSeparator()
+        self.smart_menu.addAction(a_all); self.smart_group.addAction(a_all)
+        a_all.setChecked(self.smart_active is None)
+        for sp in self.smart_playlists:
+            act = QAction(sp.name, m, checkable=True); act.setToolTip(sp.rule)
+            act.triggered.connect(lambda _, x=sp: self._smart_activate(x))
+            self.smart_menu.addAction(act); self.smart_group.addAction(act)
+            if sp is self.smart_active: act.setChecked(True)
+        self.smart_menu.addSeparator(); self.smart_menu.addAction(a_del)
+
+    def _smart_new(self):
+        name, ok = QInputDialog.getText(self, "Смарт-плейлист", "Название:")
+        if not ok or not name.strip(): return
+        rule, ok = QInputDialog.getText(self, "Смарт-плейлист",
+                                        "Правило (например: dur > 6m and artist ~ Queen and added < 30d):")
+        if not ok or not rule.strip(): return
+        try: sp = SmartPlaylist(name.strip(), rule.strip())
+        except ValueError as e:
+            QMessageBox.warning(self, "Смарт-плейлист", str(e)); return
+        self.smart_playlists.append(sp)
+        self._smart_activate(sp)
+
+    def _smart_activate(self, sp):
+        self.smart_active = sp
+        if sp: sp.refresh(self.columns)
+        self._smart_rebuild_menu()
+        self._filter()
+
+    def _smart_delete(self):
+        if not self.smart_active: return
+        self.smart_playlists.remove(self.smart_active)
+        self._smart_activate(None)
+
+    def _shutdown(self):
+        self.fetch.cancel_all(); self.fetch.pool.clear()
+        self._save_library()
 
     def _show_mini(self):
         if not self.mini: self.mini = MiniPlayer(self)
@@ -660,6 +1170,7 @@ class SmartPlayer(QMainWindow):
     def _table_menu(self, pos: QPoint):
         row = self.table.indexAt(pos).row()
         if row < 0: return
+        row = self.model.source_row(row)
         menu = QMenu(self)
         act_playnext = QAction("Играть далее (Play Next)", self)
         act_enqueue = QAction("Добавить в очередь", self)
@@ -676,17 +1187,16 @@ class SmartPlayer(QMainWindow):
         menu.exec_(self.table.viewport().mapToGlobal(pos))
 
     def _enqueue_rows(self, rows, front=False):
-        paths = [self.playlist[r]["path"] for r in rows if 0 <= r < len(self.playlist)]
-        if front: self.queue = paths + self.queue
-        else: self.queue.extend(paths)
+        ids = [self.playlist[r].id for r in rows if 0 <= r < len(self.playlist)]
+        if front: self.queue = ids + self.queue
+        else: self.queue.extend(ids)
         self._queue_refresh()
 
     def _queue_refresh(self):
         self.queue_list.clear()
-        for path in self.queue:
-            t = next((x for x in self.playlist if x["path"] == path), None)
-            txt = f"{t['artist']} — {t['title']}" if t else os.path.basename(path)
-            self.queue_list.addItem(QListWidgetItem(txt))
+        for tid in self.queue:
+            t = self.playlist.get(tid)
+            if t: self.queue_list.addItem(QListWidgetItem(f"{t.artist} — {t.title}"))
 
     def _queue_menu(self, pos: QPoint):
         menu = QMenu(self)
@@ -709,41 +1219,47 @@ class SmartPlayer(QMainWindow):
     def _queue_play_item(self, item: QListWidgetItem):
         idx = self.queue_list.row(item)
         if 0 <= idx < len(self.queue):
-            path = self.queue.pop(idx); self._queue_refresh()
-            for i, t in enumerate(self.playlist):
-                if t["path"] == path:
-                    self.play_index(i); break
+            tid = self.queue.pop(idx); self._queue_refresh()
+            i = self.playlist.row_of(tid)
+            if i >= 0: self.play_index(i)
 
     def _open_file(self, row: int):
-        path = self.playlist[row]["path"]; QDesktopServices.openUrl(QUrl.fromLocalFile(path))
+        path = self.playlist[row].path; QDesktopServices.openUrl(QUrl.fromLocalFile(path))
 
     def _open_folder(self, row: int):
-        path = self.playlist[row]["path"]; folder = os.path.dirname(path)
+        path = self.playlist[row].path; folder = os.path.dirname(path)
         QDesktopServices.openUrl(QUrl.fromLocalFile(folder))
 
     def _remove_selected(self):
-        rows = sorted({idx.row() for idx in self.table.selectedIndexes()}, reverse=True)
+        rows = [self.model.source_row(idx.row()) for idx in self.table.selectionModel().selectedRows()]
         if not rows: return
-        for r in rows:
-            if r < len(self.playlist):
-                path = self.playlist[r]["path"]
-                self.queue = [p for p in self.queue if p != path]
-                del self.playlist[r]
-                self.table.removeRow(r)
-                if r == self.index:
-                    self.player.stop(); self.index = -1
-        for i in range(self.table.rowCount()):
-            self.table.setItem(i, 0, QTableWidgetItem(str(i + 1)))
+        gone = self.playlist.remove_rows(rows)
+        for sp in self.smart_playlists: sp.discard(gone)
+        gone = set(gone)
+        self.queue = [tid for tid in self.queue if tid not in gone]
+        if self.current_id in gone:
+            self.player.stop(); self.current_id = -1; self.model.current_id = -1
+        self.index = self.playlist.row_of(self.current_id)
+        self.model.set_rows(None)
         self._queue_refresh()
+        self._filter()
 
     def _save_settings(self):
         self.settings.setValue("theme", self.theme.name)
         self.settings.setValue("volume", self.volume.value())
         self.settings.setValue("repeat_mode", self.repeat_mode)
         self.settings.setValue("shuffle", self.shuffle)
+        self.settings.setValue("autoplay", self.autoplay)
         self.settings.setValue("geometry", self.saveGeometry())
         self.settings.setValue("windowState", self.saveState())
+        self.settings.setValue("smart_playlists", json.dumps([{"name": sp.name, "rule": sp.rule} for sp in self.smart_playlists], ensure_ascii=False))
         self.settings.setValue("last_playlist", self.settings.value("last_playlist", ""))
+        self._save_library()
+
+    def _save_library(self):
+        if not self.library_dirty: return
+        try: save_library(self.library); self.library_dirty = False
+        except OSError: pass
 
     def _load_settings(self):
         name = self.settings.value("theme", "Тёмная")
@@ -752,18 +1268,20 @@ class SmartPlayer(QMainWindow):
         vol = int(self.settings.value("volume", 80)); self.volume.setValue(vol); self.player.setVolume(vol)
         self.repeat_mode = int(self.settings.value("repeat_mode", 0)); self.btn_rep.setText(["🚫", "🔁", "🔂"][self.repeat_mode])
         self.shuffle = self.settings.value("shuffle", "false") in ("true", True); self.btn_shuf.setChecked(self.shuffle)
+        self.autoplay = self.settings.value("autoplay", "false") in ("true", True); self.a_autoplay.setChecked(self.autoplay)
         geom = self.settings.value("geometry"); state = self.settings.value("windowState")
         if geom is not None: self.restoreGeometry(geom)
         if state is not None: self.restoreState(state)
+        try:
+            for d in json.loads(self.settings.value("smart_playlists", "[]") or "[]"):
+                self.smart_playlists.append(SmartPlaylist(d["name"], d["rule"]))
+        except (ValueError, KeyError, TypeError): pass
+        self._smart_rebuild_menu()
         last = self.settings.value("last_playlist", "")
         if last and os.path.exists(last):
             try:
-                with open(last, "r", encoding="utf-8") as f:
-                    for line in f:
-                        p = line.strip()
-                        if p and os.path.exists(p): self._add_track(p)
-                if self.index == -1 and self.playlist: self.play_index(0, fade=False)
-            except Exception: pass
+                with open(last, "r", encoding="utf-8") as f: self._add_paths([p for p in map(str.strip, f) if p], fade=False)
+            except (OSError, UnicodeDecodeError): pass
 
     def _fade_out_then(self, after):
         self.fade_base_volume = self.volume.value()
@@ -798,9 +1316,85 @@ class SmartPlayer(QMainWindow):
         t.timeout.connect(tick); t.start(interval)
 
 
-if __name__ == "__main__":
+def bench_memory(n: int):
+    artists = [f"Artist {i}" for i in range(max(1, n // 20))]
+    def rows():
+        for i in range(n):
+            a = (artists[i % len(artists)] + " ")[:-1]
+            yield f"/music/{a}/Album {i // 12}/{i % 12 + 1:02d} - Track {i}.mp3", a, f"Track {i}", 180.0 + i % 240
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    store = TrackStore(); now = time.time()
+    for path, a, title, dur in rows(): store.add(path, a, title, dur, now, False)
+    compact = tracemalloc.get_traced_memory()[0] - base
+    del store
+    base = tracemalloc.get_traced_memory()[0]
+    dicts = [{"path": path, "artist": a, "title": title, "art": None, "dur": dur} for path, a, title, dur in rows()]
+    plain = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del dicts
+    print(f"Треков: {n} (только Python-объекты, без обложек и ячеек таблицы)")
+    print(f"TrackStore: {compact / n:.0f} байт/трек ({compact / 2**20:.1f} МБ)")
+    print(f"dict на трек: {plain / n:.0f} байт/трек ({plain / 2**20:.1f} МБ)")
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(description="Music Player Pro — индексация библиотеки и экспорт M3U без GUI")
+    ap.add_argument("--scan", nargs="+", metavar="DIR", help="папки (или файлы) для сканирования")
+    ap.add_argument("--export", metavar="FILE", help="сохранить M3U-плейлист")
+    ap.add_argument("--index", metavar="FILE", default=LIBRARY_INDEX, help="файл индекса библиотеки")
+    ap.add_argument("--jobs", type=int, default=0, help="число процессов (по умолчанию — все ядра)")
+    ap.add_argument("--features", action="store_true", help="рассчитать аудио-признаки для автоплея похожих треков")
+    ap.add_argument("--retry", action="store_true", help="с --features: повторить треки, помеченные как нечитаемые")
+    ap.add_argument("--prune", action="store_true", help="удалить из индекса отсутствующие файлы")
+    ap.add_argument("--set-last", action="store_true", help="сделать экспорт плейлистом по умолчанию для GUI")
+    ap.add_argument("--bench-memory", type=int, metavar="N", help="замерить память на трек для N синтетических треков")
+    return ap
+
+
+def run_cli(args) -> int:
+    lib = load_library(args.index)
+    if args.prune:
+        gone = [p for p in lib if not os.path.exists(p)]
+        for p in gone: del lib[p]
+        print(f"Удалено из индекса: {len(gone)}")
+    paths = scan_roots(args.scan) if args.scan else sorted(lib)
+    if args.scan:
+        t0 = time.time()
+        def progress(n, total):
+            if n == total or n % 500 == 0: print(f"\rТеги: {n}/{total}", end="", flush=True)
+        n = index_paths(paths, lib, args.jobs, progress)
+        if n: print()
+        print(f"Найдено: {len(paths)}, обновлено: {n}, за {time.time() - t0:.1f} с")
+    if args.features:
+        t0 = time.time()
+        def progress(n, total):
+            print(f"\rПризнаки: {n}/{total}", end="", flush=True)
+        n = index_features(paths, lib, args.jobs, progress, args.retry)
+        if n: print()
+        print(f"Признаки рассчитаны: {n}, за {time.time() - t0:.1f} с")
+    save_library(lib, args.index)
+    if args.export:
+        fp = os.path.abspath(args.export)
+        write_m3u(fp, [p for p in paths if p in lib])
+        print(f"Плейлист: {fp}")
+        if args.set_last: QSettings("MusicPlayerPro", "SmartPlayer").setValue("last_playlist", fp)
+    return 0
+
+
+def main():
+    args, _ = build_arg_parser().parse_known_args()
+    if args.bench_memory:
+        bench_memory(args.bench_memory); sys.exit(0)
+    if args.scan or args.export or args.prune or args.features:
+        sys.exit(run_cli(args))
+    socket.setdefaulttimeout(NET_TIMEOUT)
     app = QApplication(sys.argv)
     app.setQuitOnLastWindowClosed(False)
     font = QFont(); font.setPointSize(10); app.setFont(font)
     win = SmartPlayer(); win.show()
     sys.exit(app.exec_())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+import re
+import time
+
+import numpy as np
+
+
+FEAT_BANDS = 8
+FEAT_DIM = FEAT_BANDS + 3
+
+
+def compute_features(x: np.ndarray, rate: int) -> np.ndarray:
+    frame, hop = 1024, 512
+    if len(x) < frame * 4: return None
+    frames = np.lib.stride_tricks.sliding_window_view(x, frame)[::hop] * np.hanning(frame).astype(np.float32)
+    mag = np.abs(np.fft.rfft(frames, axis=1)).astype(np.float32)
+    power = mag ** 2
+    freqs = np.fft.rfftfreq(frame, 1.0 / rate)
+    total = power.sum(axis=1) + 1e-12
+    centroid = float(np.mean(power @ freqs / total) / (rate / 2))
+    edges = np.geomspace(40.0, rate / 2, FEAT_BANDS + 1)
+    band_idx = np.clip(np.searchsorted(edges, freqs, side="right") - 1, 0, FEAT_BANDS - 1)
+    band = np.bincount(band_idx, weights=power.sum(axis=0), minlength=FEAT_BANDS)
+    band = band / (band.sum() + 1e-12)
+    rms = float(np.sqrt(np.mean(x ** 2)))
+    flux = np.maximum(np.diff(np.log1p(mag), axis=0), 0.0).sum(axis=1)
+    flux -= flux.mean()
+    ac = np.fft.irfft(np.abs(np.fft.rfft(flux, 2 * len(flux))) ** 2)[:len(flux)]
+    fps = rate / hop
+    lo, hi = int(60 * fps / 200), int(60 * fps / 80) + 1
+    tempo = 60 * fps / (lo + int(np.argmax(ac[lo:hi]))) if hi < len(ac) else 0.0
+    return np.array([centroid, *band, rms, tempo / 200.0], dtype=np.float32)
+
+
+LRC_TIME = re.compile(r"\s*\[(\d+):(\d+(?:[.:]\d+)?)\]")
+LRC_OFFSET = re.compile(r"(?mi)^\s*\[offset:\s*([+-]?\d+)\s*\]")
+
+
+def parse_lrc(text: str):
+    m = LRC_OFFSET.search(text); offset = int(m.group(1)) if m else 0
+    pairs = []
+    for ln in text.splitlines():
+        stamps = []; pos = 0
+        while True:
+            m = LRC_TIME.match(ln, pos)
+            if not m: break
+            stamps.append(int(m.group(1)) * 60_000 + int(round(float(m.group(2).replace(":", ".")) * 1000)))
+            pos = m.end()
+        words = ln[pos:].strip()
+        for ms in stamps: pairs.append((max(0, ms - offset), words))
+    if not pairs: return None
+    pairs.sort(key=lambda p: p[0])
+    return np.array([p[0] for p in pairs], dtype=np.int64), [p[1] for p in pairs]
+
+
+class StringDict:
+    def __init__(self):
+        self.values = []; self.codes = {}; self.lower = []
+
+    def encode(self, v: str) -> int:
+        c = self.codes.get(v)
+        if c is None:
+            c = self.codes[v] = len(self.values)
+            self.values.append(v); self.lower.append(v.lower())
+        return c
+
+    def matching(self, sub: str, exact: bool = False) -> np.ndarray:
+        sub = sub.lower()
+        return np.fromiter((i for i, v in enumerate(self.lower) if (v == sub if exact else sub in v)), dtype=np.int32)
+
+
+def _grow(a: np.ndarray, n: int) -> np.ndarray:
+    b = np.zeros((n + n // 4 + 64,) + a.shape[1:], a.dtype); b[:len(a)] = a
+    return b
+
+
+class TrackColumns:
+    # Titles are not interned: each one is kept lowercased as a "\n"-terminated
+    # segment of a single string, and the title column holds the segment index.
+    # Retitled or deleted rows leave dead segments until the next compaction.
+    _COLS = ("_ids", "_dur", "_added", "_artist", "_title")
+
+    def __init__(self):
+        self.n = 0
+        self.artists = StringDict()
+        self._ids = np.zeros(0, np.int64)
+        self._dur = np.zeros(0, np.float64)
+        self._added = np.zeros(0, np.float64)
+        self._artist = np.zeros(0, np.int32)
+        self._title = np.zeros(0, np.int32)
+        self._feat = None; self._has_feat = None
+        self._text = ""; self._parts = []; self._joined = 0
+        self._ends = np.zeros(0, np.int64); self.segs = 0
+
+    def append(self, t: "Track", dur: float, added: float, feat=None):
+        i = self.n
+        if i == len(self._ids):
+            for name in self._COLS + (("_feat", "_has_feat") if self._feat is not None else ()):
+                setattr(self, name, _grow(getattr(self, name), i + 1))
+        self._ids[i] = t.id; self._dur[i] = dur; self._added[i] = added
+        a = self._artist[i] = self.artists.encode(t.artist); t.artist = self.artists.values[a]
+        self._title[i] = self._add_title(t.title)
+        self.n += 1
+        self.set_feat(i, feat)
+
+    def update(self, row: int, t: "Track", dur: float):
+        a = self._artist[row] = self.artists.encode(t.artist); t.artist = self.artists.values[a]
+        if self._segment(int(self._title[row])) != t.title.lower().replace("\n", " "):
+            self._title[row] = self._add_title(t.title)
+            if self.segs > 2 * self.n + 4096: self._compact_titles()
+        self._dur[row] = dur
+
+    def set_feat(self, row: int, feat):
+        ok = feat is not None and len(feat) == FEAT_DIM
+        if self._feat is None:
+            if not ok: return
+            self._feat = np.zeros((len(self._ids), FEAT_DIM), np.float32); self._has_feat = np.zeros(len(self._ids), bool)
+        self._feat[row] = feat if ok else 0.0; self._has_feat[row] = ok
+
+    def _add_title(self, title: str) -> int:
+        s = title.lower().replace("\n", " ") + "\n"
+        k = self.segs
+        if k == len(self._ends): self._ends = _grow(self._ends, k + 1)
+        self._ends[k] = (self._ends[k - 1] if k else 0) + len(s)
+        self._parts.append(s); self.segs += 1
+        if len(self._parts) >= 4096: self._titles()
+        return k
+
+    def _titles(self) -> str:
+        if self._parts:
+            self._text += "".join(self._parts); self._parts = []; self._joined = self.segs
+        return self._text
+
+    def _segment(self, k: int) -> str:
+        if k >= self._joined: return self._parts[k - self._joined][:-1]
+        return self._text[(self._ends[k - 1] if k else 0):self._ends[k] - 1]
+
+    def _compact_titles(self):
+        live = [self._segment(int(k)) + "\n" for k in self._title[:self.n]]
+        self._text = "".join(live); self._parts = []; self._joined = self.segs = len(live)
+        self._ends = np.cumsum(np.fromiter(map(len, live), np.int64, len(live)))
+        self._title[:self.n] = np.arange(self.n)
+
+    def matches(self, field: str, sub: str, exact: bool = False, start: int = 0, stop: int = None) -> np.ndarray:
+        stop = self.n if stop is None else stop
+        sub = sub.lower()
+        if field == "artist":
+            codes = self._artist[start:stop]
+            hit = np.zeros(len(self.artists.values), bool); hit[self.artists.matching(sub, exact)] = True
+            return hit[codes]
+        segs = self._title[start:stop]
+        if len(segs) <= 16:
+            return np.array([(v == sub if exact else sub in v) for v in map(self._segment, segs.tolist())], bool)
+        pat = r"(?<![^\n])" + re.escape(sub) + r"\n" if exact else re.escape(sub)
+        pos = np.fromiter((m.start() for m in re.finditer(pat, self._titles())), np.int64)
+        hit = np.zeros(self.segs + 1, bool); hit[np.searchsorted(self._ends[:self.segs], pos, side="right")] = True
+        return hit[segs]
+
+    def search(self, text: str) -> np.ndarray:
+        return self.matches("artist", text) | self.matches("title", text)
+
+    def nearest(self, row: int, exclude=(), k: int = 5) -> np.ndarray:
+        n = self.n
+        if not (0 <= row < n) or self._feat is None or not self._has_feat[row]: return np.empty(0, np.int64)
+        X = self._feat[:n]; ok = self._has_feat[:n].copy()
+        sd = X[ok].std(axis=0) + 1e-6
+        d = (((X - X[row]) / sd) ** 2).sum(axis=1)
+        ok[row] = False; ok[list(exclude)] = False
+        d[~ok] = np.inf
+        k = min(k, int(ok.sum()))
+        if k <= 0: return np.empty(0, np.int64)
+        best = np.argpartition(d, k - 1)[:k]
+        return best[np.argsort(d[best])]
+
+    def delete(self, rows):
+        keep = np.ones(self.n, bool); keep[list(rows)] = False
+        m = int(keep.sum())
+        for name in self._COLS + (("_feat", "_has_feat") if self._feat is not None else ()):
+            a = getattr(self, name); a[:m] = a[:self.n][keep]
+        self.n = m
+        if self.segs > 2 * self.n + 4096: self._compact_titles()
+
+    def clear(self):
+        self.__init__()
+
+    ids = property(lambda self: self._ids[:self.n])
+    dur = property(lambda self: self._dur[:self.n])
+    added = property(lambda self: self._added[:self.n])
+    artist = property(lambda self: self._artist[:self.n])
+    title = property(lambda self: self._title[:self.n])
+    has_feat = property(lambda self: self._has_feat[:self.n] if self._feat is not None else np.zeros(self.n, bool))
+
+
+class Track:
+    __slots__ = ("id", "path", "artist", "title", "has_art")
+
+    def __init__(self, tid: int, path: str, artist: str, title: str, has_art: bool):
+        self.id = tid; self.path = path
+        self.artist = artist; self.title = title
+        self.has_art = has_art
+
+
+class TrackStore:
+    # ids only grow and rows keep insertion order, so columns.ids stays sorted
+    def __init__(self):
+        self.tracks = []
+        self.columns = TrackColumns()
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __getitem__(self, row: int) -> Track:
+        return self.tracks[row]
+
+    def __iter__(self):
+        return iter(self.tracks)
+
+    def row_of(self, tid: int) -> int:
+        ids = self.columns.ids
+        r = int(np.searchsorted(ids, tid))
+        return r if r < len(ids) and ids[r] == tid else -1
+
+    def get(self, tid: int):
+        r = self.row_of(tid)
+        return self.tracks[r] if r >= 0 else None
+
+    def dur(self, row: int) -> float:
+        return float(self.columns.dur[row])
+
+    def add(self, path: str, artist: str, title: str, dur: float, added: float, has_art: bool, feat=None) -> Track:
+        t = Track(self.next_id, path, artist, title, bool(has_art))
+        self.next_id += 1
+        self.tracks.append(t); self.columns.append(t, dur, added, feat)
+        return t
+
+    def update(self, tid: int, artist: str, title: str, dur: float, has_art: bool) -> int:
+        r = self.row_of(tid)
+        if r < 0: return r
+        t = self.tracks[r]
+        t.artist = artist; t.title = title; t.has_art = bool(has_art)
+        self.columns.update(r, t, float(dur))
+        return r
+
+    def remove_rows(self, rows) -> list:
+        rows = sorted({r for r in rows if 0 <= r < len(self.tracks)})
+        gone = [self.tracks[r].id for r in rows]
+        self.columns.delete(rows)
+        for r in reversed(rows): del self.tracks[r]
+        return gone
+
+    def clear(self):
+        self.tracks.clear(); self.columns.clear()
+
+
+RULE_FIELDS = {"dur": "dur", "duration": "dur", "artist": "artist", "title": "title", "added": "added"}
+# a value is quoted only if the quote opens right after the operator and closes
+# right before "and"/"и"/"&&" or the end; other apostrophes are plain text
+RULE_COND = re.compile(r"""\s*(\w+)\s*(>=|<=|!=|!~|>|<|=|~)\s*(?:"([^"]*)"|'([^']*)'|(.*?))\s*(?:$|\s+(?:and|и|&&)\s+)""",
+                       re.IGNORECASE)
+RULE_SPAN = re.compile(r"^(\d+(?:[.,]\d+)?)\s*([^\d\s.,]*)$")
+SPAN_UNITS = {"s": 1, "с": 1, "m": 60, "м": 60, "h": 3600, "ч": 3600, "d": 86400, "д": 86400, "w": 604800, "н": 604800}
+SPAN_STEMS = (("sec", 1), ("сек", 1), ("min", 60), ("мин", 60), ("hour", 3600), ("hr", 3600), ("час", 3600),
+              ("day", 86400), ("дн", 86400), ("ден", 86400), ("week", 604800), ("wk", 604800), ("нед", 604800))
+
+
+def _parse_span(v: str, unit: str) -> float:
+    v = v.strip().lower()
+    try:
+        if ":" in v:
+            m, s = v.split(":", 1); return float(m) * 60 + float(s)
+    except ValueError:
+        raise ValueError(f"Не понимаю значение: {v!r}") from None
+    m = RULE_SPAN.match(v)
+    if not m: raise ValueError(f"Не понимаю значение: {v!r}")
+    word = m.group(2) or unit
+    mult = SPAN_UNITS.get(word) or next((k for stem, k in SPAN_STEMS if word.startswith(stem)), None)
+    if mult is None: raise ValueError(f"Неизвестная единица: {m.group(2)!r} (s/min/h/d/w)")
+    return float(m.group(1).replace(",", ".")) * mult
+
+
+def parse_rule(text: str) -> list:
+    conds = []; text = text.strip(); pos = 0
+    while True:
+        m = RULE_COND.match(text, pos)
+        if not m: raise ValueError(f"Не понимаю условие: {text[pos:]!r}")
+        field, op = m.group(1).lower(), m.group(2)
+        val = next(v for v in m.group(3, 4, 5) if v is not None)
+        if m.group(5) is not None and len(val) > 1 and val[0] == val[-1] and val[0] in "\"'": val = val[1:-1]
+        if field not in RULE_FIELDS: raise ValueError(f"Неизвестное поле: {field}")
+        if not val: raise ValueError(f"Пустое значение для {field}")
+        field = RULE_FIELDS[field]
+        if field in ("artist", "title"):
+            if op not in ("=", "!=", "~", "!~"): raise ValueError(f"Оператор {op} не подходит для {field}")
+        else:
+            if "~" in op: raise ValueError(f"Оператор {op} не подходит для {field}")
+            val = _parse_span(val, "s" if field == "dur" else "d")
+        conds.append((field, op, val))
+        pos = m.end()
+        if pos >= len(text): return conds
+
+
+def eval_rule(conds, cols: TrackColumns, start: int = 0, now: float = None, stop: int = None) -> np.ndarray:
+    stop = cols.n if stop is None else stop
+    mask = np.ones(stop - start, bool)
+    now = time.time() if now is None else now
+    for field, op, val in conds:
+        if field in ("artist", "title"):
+            hit = cols.matches(field, val, op in ("=", "!="), start, stop)
+            m = ~hit if op.startswith("!") else hit
+        else:
+            col = cols.dur[start:stop] if field == "dur" else now - cols.added[start:stop]
+            m = {">": col > val, "<": col < val, ">=": col >= val, "<=": col <= val,
+                 "=": col == val, "!=": col != val}[op]
+        mask &= m
+    return np.flatnonzero(mask) + start
+
+
+class SmartPlaylist:
+    def __init__(self, name: str, rule: str):
+        self.name = name
+        self.rule = rule
+        self.conds = parse_rule(rule)
+        self.ids = set()
+        self.seen_id = -1
+        self.time_based = any(f == "added" for f, _, _ in self.conds)
+
+    def refresh(self, cols: TrackColumns):
+        rows = eval_rule(self.conds, cols)
+        self.ids = set(cols.ids[rows].tolist())
+        self.seen_id = int(cols.ids[-1]) if cols.n else -1
+
+    def sync(self, cols: TrackColumns):
+        if self.time_based:
+            self.refresh(cols); return
+        start = int(np.searchsorted(cols.ids, self.seen_id, side="right"))
+        if start >= cols.n: return
+        self.ids.update(cols.ids[eval_rule(self.conds, cols, start)].tolist())
+        self.seen_id = int(cols.ids[-1])
+
+    def discard(self, ids):
+        self.ids.difference_update(ids)
+
+    def recheck(self, cols: TrackColumns, row: int):
+        tid = int(cols.ids[row]); self.ids.discard(tid)
+        if tid <= self.seen_id and len(eval_rule(self.conds, cols, row, stop=row + 1)): self.ids.add(tid)
+
+    def mask(self, cols: TrackColumns) -> np.ndarray:
+        return np.isin(cols.ids, np.fromiter(self.ids, np.int64, len(self.ids)))
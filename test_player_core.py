@@ -0,0 +1,115 @@
+import time
+
+import numpy as np
+import pytest
+
+from player_core import TrackStore, SmartPlaylist, parse_rule, _parse_span, eval_rule, parse_lrc
+
+DAY = 86400.0
+
+
+def make_store(rows, now=1_000_000.0):
+    store = TrackStore()
+    for artist, title, dur, age in rows:
+        store.add(f"/music/{artist}/{title}.mp3", artist, title, dur, now - age, False)
+    return store
+
+
+def test_parse_rule_units_and_separators():
+    assert parse_rule("dur > 6m and added < 30d") == [("dur", ">", 360.0), ("added", "<", 30 * DAY)]
+    assert parse_rule("duration >= 2:30 и artist ~ queen && title != intro") == [
+        ("dur", ">=", 150.0), ("artist", "~", "queen"), ("title", "!=", "intro")]
+
+
+def test_parse_rule_quoted_values_keep_separators():
+    assert parse_rule('artist = "Simon and Garfunkel"') == [("artist", "=", "Simon and Garfunkel")]
+    assert parse_rule("title ~ 'rock и roll' and dur < 5 min") == [("title", "~", "rock и roll"), ("dur", "<", 300.0)]
+
+
+def test_parse_rule_apostrophes_are_not_quotes():
+    assert parse_rule("artist ~ Guns N' Roses and dur > 5m") == [("artist", "~", "Guns N' Roses"), ("dur", ">", 300.0)]
+    assert parse_rule("title ~ don't and dur > 3 min") == [("title", "~", "don't"), ("dur", ">", 180.0)]
+    assert parse_rule("artist = 'Guns N' Roses' and dur > 5m") == [("artist", "=", "Guns N' Roses"), ("dur", ">", 300.0)]
+
+
+@pytest.mark.parametrize("rule", ["dur > ", "tempo > 5", "dur ~ 5m", "artist > x", "artist =", "dur > 6 parsecs",
+                                  "dur > 5m and"])
+def test_parse_rule_rejects(rule):
+    with pytest.raises(ValueError):
+        parse_rule(rule)
+
+
+@pytest.mark.parametrize("value, unit, seconds", [
+    ("90", "s", 90.0), ("1,5", "s", 1.5), ("6m", "s", 360.0), ("6 min", "s", 360.0), ("6 мин", "s", 360.0),
+    ("2h", "s", 7200.0), ("3:05", "s", 185.0), ("2", "d", 2 * DAY), ("2 дня", "s", 2 * DAY), ("1 week", "s", 7 * DAY),
+])
+def test_parse_span_units(value, unit, seconds):
+    assert _parse_span(value, unit) == seconds
+
+
+def test_parse_span_reports_bad_unit():
+    with pytest.raises(ValueError, match="Неизвестная единица"):
+        _parse_span("6 parsecs", "s")
+
+
+def test_eval_rule_columns():
+    store = make_store([("Queen", "Bohemian Rhapsody", 355, 40 * DAY), ("Queen", "Innuendo", 390, 2 * DAY),
+                        ("Guns N' Roses", "Don't Cry", 284, 1 * DAY), ("ABBA", "SOS", 200, 100 * DAY)])
+    cols = store.columns
+    assert eval_rule(parse_rule("dur > 6m"), cols).tolist() == [1]
+    assert eval_rule(parse_rule("artist ~ queen and added < 30d"), cols, now=1_000_000.0).tolist() == [1]
+    assert eval_rule(parse_rule("title ~ don't"), cols).tolist() == [2]
+    assert eval_rule(parse_rule("title = sos"), cols).tolist() == [3]
+    assert eval_rule(parse_rule("title !~ n"), cols).tolist() == [3]
+    assert eval_rule(parse_rule("artist = queen"), cols, start=1).tolist() == [1]
+
+
+def test_title_search_survives_retitle_and_compaction():
+    store = make_store([(f"A{i % 7}", f"Song {i}", 100 + i, 0) for i in range(5000)])
+    for tid in range(0, 5000, 2): store.update(tid, f"A{tid % 7}", f"Renamed {tid}", 100 + tid, False)
+    store.remove_rows(range(0, 3000))
+    cols = store.columns
+    assert cols.segs < 2 * cols.n + 4096 + 1
+    assert np.flatnonzero(cols.search("renamed 4998")).tolist() == [1998]
+    assert [store[r].title for r in np.flatnonzero(cols.matches("title", "song 3001", exact=True))] == ["Song 3001"]
+    assert int(cols.search("song").sum()) == 1000
+
+
+def test_smart_playlist_incremental_sync_after_removal():
+    store = make_store([("Queen", f"Q{i}", 400, 0) if i % 2 else ("ABBA", f"A{i}", 100, 0) for i in range(6)])
+    sp = SmartPlaylist("long", "dur > 6m")
+    sp.refresh(store.columns)
+    assert sp.ids == {1, 3, 5}
+    sp.discard(store.remove_rows([1, 2]))
+    store.add("/music/new.mp3", "Queen", "New", 500, 0, False)
+    store.add("/music/short.mp3", "Queen", "Short", 60, 0, False)
+    sp.sync(store.columns)
+    assert sp.ids == {3, 5, 6}
+    assert sp.mask(store.columns).tolist() == [False, True, False, True, True, False]
+
+
+def test_smart_playlist_recheck_and_time_based_sync():
+    store = make_store([("Unknown", "a.mp3", 0, 0)], now=time.time())
+    sp = SmartPlaylist("queen", "artist = queen")
+    sp.refresh(store.columns)
+    store.update(0, "Queen", "A", 200, False)
+    sp.recheck(store.columns, 0)
+    assert sp.ids == {0}
+    recent = SmartPlaylist("new", "added < 1d")
+    recent.refresh(store.columns)
+    assert recent.ids == {0}
+    store.columns._added[0] -= 2 * DAY
+    recent.sync(store.columns)
+    assert recent.ids == set()
+
+
+def test_parse_lrc_multi_stamp_and_offset():
+    lrc = "[ar:Someone]\n[offset:+500]\n[00:12.00][01:02.50]Chorus\n[00:05.10]First\nno stamp\n[00:00.20]Intro"
+    offsets, lines = parse_lrc(lrc)
+    assert offsets.dtype == np.int64
+    assert offsets.tolist() == [0, 4600, 11500, 62000]
+    assert lines == ["Intro", "First", "Chorus", "Chorus"]
+
+
+def test_parse_lrc_plain_text():
+    assert parse_lrc("Just words\n[Chorus]\nmore words") is None